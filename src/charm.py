@@ -7,11 +7,12 @@
 import ipaddress
 import json
 import logging
-import re
+import socket
 import subprocess
+import time
 from ipaddress import AddressValueError
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Collection, Dict, List, Optional, Tuple
 
 import netifaces  # type: ignore[import]
 from charms.lte_core_interface.v0.lte_core_interface import LTECoreProvides
@@ -26,19 +27,38 @@ from ops.charm import (
     RelationJoinedEvent,
     StartEvent,
 )
+from ops.framework import StoredState
 from ops.main import main
 from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
 
 logger = logging.getLogger(__name__)
 
-ROOT_CA_PATH = "/var/opt/magma/tmp/certs/rootCA.pem"
-CERT_CERTIFIER_CERT = "/var/opt/magma/tmp/certs/certifier.pem"
-CONFIG_PATH = "/var/opt/magma/configs/control_proxy.yml"
+ROOT_CA_PATH = Path("/var/opt/magma/tmp/certs/rootCA.pem")
+CERT_CERTIFIER_CERT = Path("/var/opt/magma/tmp/certs/certifier.pem")
+CONFIG_PATH = Path("/var/opt/magma/configs/control_proxy.yml")
+AGW_CERT_FILES = (
+    Path("/var/opt/magma/gateway.crt"),
+    Path("/var/opt/magma/gateway.key"),
+    Path("/var/opt/magma/gw_challenge.key"),
+)
+RESTART_DEBOUNCE_SECONDS = 60
+ORCHESTRATOR_RELATION_KEYS = (
+    "root_ca_certificate",
+    "certifier_pem_certificate",
+    "orchestrator_address",
+    "orchestrator_port",
+    "bootstrapper_address",
+    "bootstrapper_port",
+    "fluentd_address",
+    "fluentd_port",
+)
 
 
 def install_file(file: Path, content: str) -> bool:
     """Install file with provided text content.
 
+    The existing file is only read when its size matches the new content.
+
     Args:
         file: Path object to write to
         content: Text content to write to the file
@@ -46,23 +66,60 @@ def install_file(file: Path, content: str) -> bool:
     Returns:
         True if the file was written to
     """
+    data = content.encode()
     if not file.parent.exists():
         file.parent.mkdir()
-    elif file.exists() and file.read_text() == content:
+    else:
+        try:
+            if file.stat().st_size == len(data) and file.read_bytes() == data:
+                return False
+        except FileNotFoundError:
+            pass
+    file.write_bytes(data)
+    return True
+
+
+def is_valid_ip_address(address: str, family: int) -> bool:
+    """Validate an IP address of the given family.
+
+    Args:
+        address: IP address to validate, without netmask
+        family: Address family (socket.AF_INET or socket.AF_INET6)
+
+    Returns:
+        True if the address is valid for the given family
+    """
+    if not isinstance(address, str):
+        return False
+    try:
+        socket.inet_pton(family, address)
+    except (OSError, ValueError):
         return False
-    file.write_text(content)
     return True
 
 
+def _is_valid_ip(address: str) -> bool:
+    """Validate an IPv4 or IPv6 address, without netmask."""
+    return any(
+        is_valid_ip_address(address, family) for family in (socket.AF_INET, socket.AF_INET6)
+    )
+
+
 class MagmaAccessGatewayOperatorCharm(CharmBase):
     """Charm the service."""
 
     HARDWARE_ID_LABEL = "Hardware ID"
     CHALLENGE_KEY_LABEL = "Challenge key"
 
+    _stored = StoredState()
+
     def __init__(self, *args):
         """Observes juju events."""
         super().__init__(*args)
+        self._magma_service_running: Optional[bool] = None
+        self._stored.set_default(
+            restart_pending=False, agw_cert_removal_pending=False, last_restart=0.0
+        )
         self._lte_core_provides = LTECoreProvides(self, "lte-core")
         self.orchestrator_requirer = OrchestratorRequires(self, "magma-orchestrator")
         self.framework.observe(self.on.install, self._on_install)
@@ -160,7 +217,7 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         successful_msg = "Magma AGW post-installation checks finished successfully."
         failed_msg = "Post-installation checks failed. For more information, please check journalctl logs."  # noqa: E501
         try:
-            post_install_checks = subprocess.run(command, stdout=subprocess.PIPE)
+            post_install_checks = subprocess.run(command, stdout=subprocess.DEVNULL)
             event.set_results(
                 {
                     "post-install-checks-output": successful_msg
@@ -178,14 +235,31 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
     def _on_orchestrator_available(self, event: OrchestratorAvailableEvent):
         """Triggered when a related orchestrator is made available.
 
-        The AGW will be configured to connect to the orchestrator with the data from
-        the event. Services will then be restarted.
+        The AGW is configured from the current orchestrator relation data rather than from
+        the event, so a deferred event never brings back an outdated configuration. Services
+        will then be restarted. Restarts are coalesced: if the previous one happened less
+        than RESTART_DEBOUNCE_SECONDS ago, the event is deferred and the pending restart is
+        applied on a later hook. When the certifier certificate changes, the AGW certificates
+        are only removed right before that restart.
         """
-        if self._certifier_pem_changed(event.certifier_pem_certificate):
-            self._remove_agw_cert_files()
-        if self._install_configurations(event):
+        relation_data = self._orchestrator_relation_data
+        if relation_data:
+            if self._certifier_pem_changed(relation_data["certifier_pem_certificate"]):
+                self._stored.agw_cert_removal_pending = True
+            if self._install_configurations(relation_data):
+                self._stored.restart_pending = True
+        if self._stored.restart_pending:
+            if time.time() - self._stored.last_restart < RESTART_DEBOUNCE_SECONDS:
+                logger.info("Access Gateway restarted recently, deferring restart")
+                event.defer()
+                return
             self.unit.status = MaintenanceStatus("Restarting Access Gateway to apply changes")
+            if self._stored.agw_cert_removal_pending:
+                self._remove_agw_cert_files()
+                self._stored.agw_cert_removal_pending = False
             self._restart_magma()
+            self._stored.restart_pending = False
+            self._stored.last_restart = time.time()
         if not self._magma_service_is_running:
             event.defer()
             return
@@ -223,7 +297,7 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         """
         subprocess.run(
             ["snap", "install", "magma-access-gateway", "--classic", "--edge"],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
         )
 
     def install_magma_access_gateway(self) -> int:
@@ -245,27 +319,36 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         """Sends the command to reboot the machine in 1 minute."""
         subprocess.run(
             ["shutdown", "--reboot", "+1"],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
         )
 
     @property
     def _is_configuration_valid(self) -> bool:
-        """Validates configuration."""
-        if self.model.config["skip-networking"]:
+        """Validates configuration.
+
+        Both interfaces are always checked so that all missing interfaces are reported at once.
+        Validation stops at the first invalid addressing or DNS configuration.
+        """
+        config = self.model.config
+        if config["skip-networking"]:
             return True
-        valid = self._is_valid_interface("sgi", "eth0")
-        if not self._is_valid_interface("s1", "eth1"):
-            valid = False
+        interfaces = set(netifaces.interfaces())
+        valid_sgi_interface = self._is_valid_interface("sgi", "eth0", interfaces)
+        valid_s1_interface = self._is_valid_interface("s1", "eth1", interfaces)
+        if not valid_sgi_interface or not valid_s1_interface:
+            return False
         if not self._is_valid_sgi_interface_addressing_configuration:
-            valid = False
+            return False
         if not self._is_valid_s1_interface_addressing_configuration:
-            valid = False
-        if not self._are_valid_dns(self.model.config["dns"]):
+            return False
+        if not self._are_valid_dns(config["dns"]):
             logger.warning("Invalid DNS configuration")
-            valid = False
-        return valid
+            return False
+        return True
 
-    def _is_valid_interface(self, interface_name: str, new_interface_name: str) -> bool:
+    def _is_valid_interface(
+        self, interface_name: str, new_interface_name: str, interfaces: Collection[str]
+    ) -> bool:
         """Validates a network interface name.
 
         An interface name is required and must represent an interface present on the
@@ -276,6 +359,7 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         Args:
             interface_name: Original name of the interface
             new_interface_name: Name of the interface that will be set by Magma
+            interfaces: Interfaces present on the machine
 
         Returns:
             True if the interface name is valid and found
@@ -284,31 +368,22 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         if not interface:
             logger.warning("%s interface name is required", (interface_name))
             return False
-        if (
-            interface not in netifaces.interfaces()
-            and new_interface_name not in netifaces.interfaces()  # noqa: W503
-        ):
+        if interface not in interfaces and new_interface_name not in interfaces:
             logger.warning("%s interface not found", (interface))
             return False
         return True
 
     def _certifier_pem_changed(self, new_cert):
-        return (
-            Path(CERT_CERTIFIER_CERT).exists()
-            and Path(CERT_CERTIFIER_CERT).read_text() != new_cert  # noqa: W503
-        )
+        try:
+            stored_cert = CERT_CERTIFIER_CERT.read_bytes()
+        except FileNotFoundError:
+            return False
+        return stored_cert != new_cert.encode()
 
     @staticmethod
     def _remove_agw_cert_files():
-        for file in [
-            "/var/opt/magma/gateway.crt",
-            "/var/opt/magma/gateway.key",
-            "/var/opt/magma/gw_challenge.key",
-        ]:
-            try:
-                Path(file).unlink()
-            except FileNotFoundError:
-                logger.debug("File does not exist: " + file)
+        for file in AGW_CERT_FILES:
+            file.unlink(missing_ok=True)
 
     @property
     def _is_valid_sgi_interface_addressing_configuration(self) -> bool:
@@ -380,11 +455,7 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         A valid string will have the form:
         a.b.c.d
         """
-        try:
-            ip = ipaddress.ip_address(ipv4_gateway)
-            return isinstance(ip, ipaddress.IPv4Address)
-        except ValueError:
-            return False
+        return is_valid_ip_address(ipv4_gateway, socket.AF_INET)
 
     @staticmethod
     def _is_valid_ipv6_address(ipv6_address: str) -> bool:
@@ -407,11 +478,7 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         A valid string will contain an IPv6 address, like this:
         2001:0db8:85a3:0000:0000:8a2e:0370:7334
         """
-        try:
-            ip = ipaddress.ip_address(ipv6_gateway)
-            return isinstance(ip, ipaddress.IPv6Address)
-        except ValueError:
-            return False
+        return is_valid_ip_address(ipv6_gateway, socket.AF_INET6)
 
     @staticmethod
     def _are_valid_dns(dns: str) -> bool:
@@ -420,13 +487,9 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
             list_of_dns = json.loads(dns)
             if not isinstance(list_of_dns, list) or not list_of_dns:
                 return False
-            try:
-                [ipaddress.ip_address(dns) for dns in list_of_dns]
-            except ValueError:
-                return False
         except json.JSONDecodeError:
             return False
-        return True
+        return all(_is_valid_ip(address) for address in list_of_dns)
 
     @property
     def _install_arguments(self) -> List[str]:
@@ -435,41 +498,65 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         Returns:
             List of arguments for install command
         """
-        config = dict(self.model.config)
-        if config.pop("skip-networking"):
+        config = self.model.config
+        if config["skip-networking"]:
             return ["--no-reboot", "--skip-networking"]
         arguments = ["--no-reboot", "--dns"]
-        arguments.extend(json.loads(config.pop("dns")))
+        arguments.extend(json.loads(config["dns"]))
         for key, value in config.items():
+            if key in ("skip-networking", "dns"):
+                continue
             arguments.extend([f"--{key}", value])
         return arguments
 
     @property
     def _magma_service_is_running(self) -> bool:
-        """Checks whether magma is running."""
-        magma_service = subprocess.run(
-            ["systemctl", "is-active", "magma@magmad"],
-            stdout=subprocess.PIPE,
-        )
-        return magma_service.returncode == 0
+        """Checks whether magma is running.
+
+        The result is cached for the lifetime of the charm instance (a single hook) and
+        invalidated whenever Magma is restarted.
+        """
+        if self._magma_service_running is None:
+            magma_service = subprocess.run(
+                ["systemctl", "is-active", "magma@magmad"],
+                stdout=subprocess.DEVNULL,
+            )
+            self._magma_service_running = magma_service.returncode == 0
+        return self._magma_service_running
 
     @property
-    def _get_magma_secrets(self) -> Tuple[Optional[str], Optional[str]]:
+    def _get_magma_secrets(self) -> Tuple[str, str]:
         """Gets Access Gateway's Hardware ID and Challenge key.
 
         Hardware ID and Challenge key are available through the `show_gateway_info` script
         provided by the Access Gateway. This method filers out required values from the script's
-        output.
+        output in a single pass, taking the first non-empty, non-underline line after each label.
 
         Returns:
             str: Hardware ID
             str: Challenge key
+
+        Raises:
+            ValueError: If either value is missing from the script's output
         """
-        gateway_info = subprocess.check_output(["show_gateway_info.py"]).decode().split("\n")
-        gateway_info = list(filter(None, gateway_info))
-        gateway_info = list(filter(lambda x: (not re.search("^-(-*)", x)), gateway_info))
-        hardware_id = gateway_info[gateway_info.index(self.HARDWARE_ID_LABEL) + 1]
-        challenge_key = gateway_info[gateway_info.index(self.CHALLENGE_KEY_LABEL) + 1]
+        gateway_info = subprocess.check_output(["show_gateway_info.py"]).decode()
+        secrets: Dict[str, Optional[str]] = {
+            self.HARDWARE_ID_LABEL: None,
+            self.CHALLENGE_KEY_LABEL: None,
+        }
+        pending_label = None
+        for line in gateway_info.splitlines():
+            if not line or line.startswith("-"):
+                continue
+            if line in secrets:
+                pending_label = line
+            elif pending_label:
+                secrets[pending_label] = line
+                pending_label = None
+        hardware_id = secrets[self.HARDWARE_ID_LABEL]
+        challenge_key = secrets[self.CHALLENGE_KEY_LABEL]
+        if not hardware_id or not challenge_key:
+            raise ValueError("Hardware ID or Challenge key not found in gateway info")
         return hardware_id, challenge_key
 
     @property
@@ -477,31 +564,48 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
         """Validates if magmad service is enabled."""
         magma_service = subprocess.run(
             ["systemctl", "is-enabled", "magma@magmad"],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
         )
         return not magma_service.returncode
 
-    def _install_configurations(self, event: OrchestratorAvailableEvent) -> bool:
+    @property
+    def _orchestrator_relation_data(self) -> Optional[Dict[str, str]]:
+        """Returns the orchestrator's application data from the magma-orchestrator relation.
+
+        Returns:
+            Relation data, or None if the relation or any of the required keys is missing
+        """
+        relation = self.model.get_relation("magma-orchestrator")
+        if not relation or not relation.app:
+            return None
+        relation_data = relation.data[relation.app]
+        if not all(key in relation_data for key in ORCHESTRATOR_RELATION_KEYS):
+            return None
+        return dict(relation_data)
+
+    def _install_configurations(self, relation_data: Dict[str, str]) -> bool:
         """Install or update configuration files.
 
+        Args:
+            relation_data: Orchestrator's application data from the magma-orchestrator relation
+
         Returns:
             True if any changes were applied
         """
         config = self._generate_config(
-            orchestrator_address=event.orchestrator_address,
-            orchestrator_port=event.orchestrator_port,
-            bootstrapper_address=event.bootstrapper_address,
-            bootstrapper_port=event.bootstrapper_port,
-            fluentd_address=event.fluentd_address,
-            fluentd_port=event.fluentd_port,
+            orchestrator_address=relation_data["orchestrator_address"],
+            orchestrator_port=int(relation_data["orchestrator_port"]),
+            bootstrapper_address=relation_data["bootstrapper_address"],
+            bootstrapper_port=int(relation_data["bootstrapper_port"]),
+            fluentd_address=relation_data["fluentd_address"],
+            fluentd_port=int(relation_data["fluentd_port"]),
         )
-        return any(
-            [
-                install_file(Path(ROOT_CA_PATH), event.root_ca_certificate),
-                install_file(Path(CERT_CERTIFIER_CERT), event.certifier_pem_certificate),
-                install_file(Path(CONFIG_PATH), config),
-            ]
+        root_ca_changed = install_file(ROOT_CA_PATH, relation_data["root_ca_certificate"])
+        certifier_changed = install_file(
+            CERT_CERTIFIER_CERT, relation_data["certifier_pem_certificate"]
         )
+        config_changed = install_file(CONFIG_PATH, config)
+        return root_ca_changed or certifier_changed or config_changed
 
     @staticmethod
     def _generate_config(
@@ -523,15 +627,15 @@ class MagmaAccessGatewayOperatorCharm(CharmBase):
             f"rootca_cert: {ROOT_CA_PATH}\n"
         )
 
-    @staticmethod
-    def _restart_magma() -> None:
+    def _restart_magma(self) -> None:
+        self._magma_service_running = None
         subprocess.run(
             ["service", "magma@*", "stop"],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
         )
         subprocess.run(
             ["service", "magma@magmad", "start"],
-            stdout=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
         )
 
 
@@ -0,0 +1,27 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import logging
+
+import pytest
+from ops import testing
+
+from charm import MagmaAccessGatewayOperatorCharm
+
+
+@pytest.fixture(autouse=True)
+def charm_log_level(caplog):
+    caplog.set_level(logging.WARNING, logger="charm")
+
+
+@pytest.fixture(autouse=True)
+def network_interfaces(monkeypatch):
+    monkeypatch.setattr("netifaces.interfaces", lambda: ["enp0s1", "enp0s2"])
+
+
+@pytest.fixture
+def harness():
+    harness = testing.Harness(MagmaAccessGatewayOperatorCharm)
+    harness.begin()
+    yield harness
+    harness.cleanup()
@@ -1,1109 +1,741 @@
 # Copyright 2021 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import itertools
 import pathlib
+import socket
 import tempfile
-import unittest
-from unittest.mock import Mock, call, patch
+import time
+from unittest.mock import Mock, patch
 
-from ops import testing
+import pytest
 from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
 
-from charm import MagmaAccessGatewayOperatorCharm, install_file
-
-
-class TestMagmaAccessGatewayOperatorCharm(unittest.TestCase):
-    def setUp(self):
-        self.harness = testing.Harness(MagmaAccessGatewayOperatorCharm)
-        self.addCleanup(self.harness.cleanup)
-        self.harness.begin()
-        self.charm = self.harness.charm
-
-    @patch("subprocess.run")
-    def test_given_no_config_provided_when_install_then_snap_is_installed_and_status_is_blocked(
-        self, patch_subprocess_run
-    ):
-        event = Mock()
-        patch_subprocess_run.side_effect = [Mock(returncode=1), Mock(returncode=0)]
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(["systemctl", "is-enabled", "magma@magmad"], stdout=-1),
-                call(
-                    ["snap", "install", "magma-access-gateway", "--classic", "--edge"], stdout=-1
-                ),
-            ]
-        )
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual("sgi interface name is required", captured.records[0].getMessage())
-        self.assertEqual("s1 interface name is required", captured.records[1].getMessage())
-
-    @patch("subprocess.run")
-    def test_given_skip_networking_config_provided_when_install_then_snap_is_installed_and_status_is_maintenance(  # noqa: E501
-        self, patch_subprocess_run
-    ):
-        event = Mock()
-        patch_subprocess_run.side_effect = [
-            Mock(returncode=1),
-            Mock(returncode=0),
-            Mock(returncode=0),
-            Mock(returncode=0),
-            Mock(returncode=0),
-        ]
-        self.harness.update_config({"skip-networking": True})
-        self.charm._on_install(event=event)
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(["systemctl", "is-enabled", "magma@magmad"], stdout=-1),
-                call(
-                    ["snap", "install", "magma-access-gateway", "--classic", "--edge"], stdout=-1
-                ),
-                call(
-                    ["magma-access-gateway.install", "--no-reboot", "--skip-networking"],
-                    stdout=-1,
-                ),
-                call(["shutdown", "--reboot", "+1"], stdout=-1),
-                call(["systemctl", "is-enabled", "magma@magmad"], stdout=-1),
-            ]
-        )
-
-        self.assertEqual(
-            self.charm.unit.status,
-            MaintenanceStatus("Rebooting to apply changes"),
-        )
-
-    @patch("subprocess.run")
-    def test_given_skip_networking_config_provided_when_update_config_fails_then_status_is_blocked(  # noqa: E501
-        self, patch_subprocess_run
-    ):
-        patch_subprocess_run.side_effect = [
-            Mock(returncode=1),
-            Mock(returncode=0),
-            Mock(returncode=1),
-        ]
-        self.harness.update_config({"skip-networking": True})
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(["systemctl", "is-enabled", "magma@magmad"], stdout=-1),
-                call(
-                    ["snap", "install", "magma-access-gateway", "--classic", "--edge"], stdout=-1
-                ),
-                call(
-                    ["magma-access-gateway.install", "--no-reboot", "--skip-networking"],
-                    stdout=-1,
-                ),
-            ]
-        )
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Installation script failed. See logs for details"),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_interfaces_config_when_install_then_status_is_blocked(
-        self, patch_interfaces, patch_subprocess_run
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "nosuchinterface", "s1": "bananaphone"})
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual("nosuchinterface interface not found", captured.records[0].getMessage())
-        self.assertEqual("bananaphone interface not found", captured.records[1].getMessage())
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_sgi_ipv4_address_and_no_gateway_in_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv4-address": "10.0.0.2/24",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
-            "Both IPv4 address and gateway required for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_sgi_ipv4_gateway_and_no_address_in_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv4-gateway": "10.0.0.1",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
-            "Both IPv4 address and gateway required for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_sgi_ipv6_address_and_no_gateway_in_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv6-address": "2001:0db8:85a3:0000:0000:8a2e:0370:7334/64",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
-            "Both IPv6 address and gateway required for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_sgi_ipv6_gateway_and_no_address_in_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv6-gateway": "2001:0db8:85a3:0000:0000:8a2e:0370:7331",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
+from charm import RESTART_DEBOUNCE_SECONDS, install_file, is_valid_ip_address
+
+IPV4_ADDRESS = "10.0.0.2/24"
+IPV4_GATEWAY = "10.0.0.1"
+IPV6_ADDRESS = "2001:0db8:85a3:0000:0000:8a2e:0370:7334/64"
+IPV6_GATEWAY = "2001:0db8:85a3:0000:0000:8a2e:0370:7331"
+
+SYSTEMCTL_IS_ENABLED = ["systemctl", "is-enabled", "magma@magmad"]
+SYSTEMCTL_IS_ACTIVE = ["systemctl", "is-active", "magma@magmad"]
+SNAP_INSTALL = ["snap", "install", "magma-access-gateway", "--classic", "--edge"]
+SHUTDOWN = ["shutdown", "--reboot", "+1"]
+SERVICE_STOP = ["service", "magma@*", "stop"]
+SERVICE_START = ["service", "magma@magmad", "start"]
+MAGMA_INSTALL = ["magma-access-gateway.install", "--no-reboot"]
+POST_INSTALL_CHECKS = ["magma-access-gateway.post-install"]
+SHOW_GATEWAY_INFO = ["show_gateway_info.py"]
+
+ORCHESTRATOR_APP_DATA = {
+    "root_ca_certificate": "root_ca_certificate_content",
+    "certifier_pem_certificate": "certifier_pem_certificate_content",
+    "orchestrator_address": "orchestrator.com",
+    "orchestrator_port": "42",
+    "bootstrapper_address": "bootstrapper.com",
+    "bootstrapper_port": "42",
+    "fluentd_address": "fluentd.com",
+    "fluentd_port": "42",
+}
+
+GATEWAY_INFO = b"""Hardware ID
+------------
+1234-abc-5678
 
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
-            "Both IPv6 address and gateway required for interface sgi",
-            captured.records[0].getMessage(),
-        )
+Challenge key
+-----------
+whatever
+"""
+GATEWAY_INFO_WITHOUT_SECRETS = b"""Hardware ID
+------------
 
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_only_ipv6_sgi_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
+Challenge key
+-----------
+"""
+
+
+@pytest.fixture
+def magma_paths(tmp_path):
+    (tmp_path / "tmp").mkdir()
+    with patch.multiple(
+        "charm",
+        ROOT_CA_PATH=tmp_path / "tmp" / "certs" / "rootCA.pem",
+        CERT_CERTIFIER_CERT=tmp_path / "tmp" / "certs" / "certifier.pem",
+        CONFIG_PATH=tmp_path / "configs" / "control_proxy.yml",
+        AGW_CERT_FILES=(
+            tmp_path / "gateway.crt",
+            tmp_path / "gateway.key",
+            tmp_path / "gw_challenge.key",
+        ),
+    ):
+        for file in ("gateway.crt", "gateway.key", "gw_challenge.key"):
+            (tmp_path / file).write_text("agw_cert_content")
+        yield tmp_path
+
+
+@pytest.fixture
+def action_event():
+    return Mock(spec=["set_results", "fail"])
+
+
+@pytest.fixture
+def failing_commands(fp):
+    """Makes every command exit non-zero, as on a host where Magma is not installed."""
+    fp.keep_last_process(True)
+    fp.register([fp.any()], returncode=1)
+    return fp
+
+
+def test_given_no_config_provided_when_install_then_snap_is_installed_and_status_is_blocked(
+    fp, harness, caplog
+):
+    event = Mock()
+    fp.register(SYSTEMCTL_IS_ENABLED, returncode=1)
+    fp.register(SNAP_INSTALL)
+    caplog.clear()
+    harness.charm._on_install(event=event)
+
+    assert list(fp.calls) == [SYSTEMCTL_IS_ENABLED, SNAP_INSTALL]
+    assert harness.charm.unit.status == BlockedStatus(
+        "Configuration is invalid. Check logs for details"
+    )
+    assert caplog.records[0].getMessage() == "sgi interface name is required"
+    assert caplog.records[1].getMessage() == "s1 interface name is required"
+
+
+def test_given_skip_networking_config_provided_when_install_then_snap_is_installed_and_status_is_maintenance(  # noqa: E501
+    fp, harness
+):
+    event = Mock()
+    fp.register(SYSTEMCTL_IS_ENABLED, returncode=1)
+    fp.register(SNAP_INSTALL)
+    fp.register([*MAGMA_INSTALL, "--skip-networking"])
+    fp.register(SHUTDOWN)
+    fp.register(SYSTEMCTL_IS_ENABLED, returncode=0)
+    harness.update_config({"skip-networking": True})
+    harness.charm._on_install(event=event)
+
+    assert list(fp.calls) == [
+        SYSTEMCTL_IS_ENABLED,
+        SNAP_INSTALL,
+        [*MAGMA_INSTALL, "--skip-networking"],
+        SHUTDOWN,
+        SYSTEMCTL_IS_ENABLED,
+    ]
+    assert harness.charm.unit.status == MaintenanceStatus("Rebooting to apply changes")
+
+
+def test_given_skip_networking_config_provided_when_update_config_fails_then_status_is_blocked(
+    fp, harness
+):
+    fp.register(SYSTEMCTL_IS_ENABLED, returncode=1)
+    fp.register(SNAP_INSTALL)
+    fp.register([*MAGMA_INSTALL, "--skip-networking"], returncode=1)
+    harness.update_config({"skip-networking": True})
+
+    assert list(fp.calls) == [
+        SYSTEMCTL_IS_ENABLED,
+        SNAP_INSTALL,
+        [*MAGMA_INSTALL, "--skip-networking"],
+    ]
+    assert harness.charm.unit.status == BlockedStatus(
+        "Installation script failed. See logs for details"
+    )
+
+
+def test_given_invalid_interfaces_config_when_install_then_status_is_blocked(
+    failing_commands, harness, caplog
+):
+    event = Mock()
+    harness.update_config({"sgi": "nosuchinterface", "s1": "bananaphone"})
+    caplog.clear()
+    harness.charm._on_install(event=event)
+
+    assert harness.charm.unit.status == BlockedStatus(
+        "Configuration is invalid. Check logs for details"
+    )
+    assert caplog.records[0].getMessage() == "nosuchinterface interface not found"
+    assert caplog.records[1].getMessage() == "bananaphone interface not found"
+
+
+def test_given_invalid_interfaces_and_invalid_dns_config_when_install_then_dns_is_not_validated(
+    failing_commands, harness, caplog
+):
+    event = Mock()
+    harness.update_config({"sgi": "nosuchinterface", "s1": "enp0s2", "dns": "notjson"})
+    caplog.clear()
+    harness.charm._on_install(event=event)
+
+    assert harness.charm.unit.status == BlockedStatus(
+        "Configuration is invalid. Check logs for details"
+    )
+    assert [record.getMessage() for record in caplog.records] == [
+        "nosuchinterface interface not found"
+    ]
+
+
+@pytest.mark.parametrize(
+    "family,kind", list(itertools.product(["IPv4", "IPv6"], ["address", "gateway"]))
+)
+def test_given_only_one_of_sgi_address_and_gateway_in_config_when_install_then_status_is_blocked(
+    failing_commands, harness, caplog, family, kind
+):
+    event = Mock()
+    sgi_addressing = {
+        "IPv4": {"address": IPV4_ADDRESS, "gateway": IPV4_GATEWAY},
+        "IPv6": {"address": IPV6_ADDRESS, "gateway": IPV6_GATEWAY},
+    }
+    harness.update_config(
+        {
+            "sgi": "enp0s1",
+            "s1": "enp0s2",
+            f"sgi-{family.lower()}-{kind}": sgi_addressing[family][kind],
+        }
+    )
+    caplog.clear()
+    harness.charm._on_install(event=event)
+
+    assert harness.charm.unit.status == BlockedStatus(
+        "Configuration is invalid. Check logs for details"
+    )
+    assert (
+        caplog.records[0].getMessage()
+        == f"Both {family} address and gateway required for interface sgi"
+    )
+
+
+@pytest.mark.parametrize(
+    "config,expected_log",
+    [
+        pytest.param(
             {
-                "sgi-ipv6-address": "2001:0db8:85a3:0000:0000:8a2e:0370:7334/64",
-                "sgi-ipv6-gateway": "2001:0db8:85a3:0000:0000:8a2e:0370:7331",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+                "sgi-ipv6-address": IPV6_ADDRESS,
+                "sgi-ipv6-gateway": IPV6_GATEWAY,
+            },
             "Pure IPv6 configuration is not supported for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_sgi_ipv4_address_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv4-address": "invalidip",
-                "sgi-ipv4-gateway": "10.0.0.1",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            id="only_ipv6_sgi",
+        ),
+        pytest.param(
+            {"sgi-ipv4-address": "invalidip", "sgi-ipv4-gateway": IPV4_GATEWAY},
             "Invalid IPv4 address and netmask for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_sgi_ipv4_address_missing_netmask_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv4-address": "10.0.0.2",
-                "sgi-ipv4-gateway": "10.0.0.1",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            id="invalid_sgi_ipv4_address",
+        ),
+        pytest.param(
+            {"sgi-ipv4-address": "10.0.0.2", "sgi-ipv4-gateway": IPV4_GATEWAY},
             "Invalid IPv4 address and netmask for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_sgi_ipv4_gateway_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv4-address": "10.0.0.2/24",
-                "sgi-ipv4-gateway": "not a gateway",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            id="sgi_ipv4_address_missing_netmask",
+        ),
+        pytest.param(
+            {"sgi-ipv4-address": IPV4_ADDRESS, "sgi-ipv4-gateway": "not a gateway"},
             "Invalid IPv4 gateway for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_sgi_ipv6_address_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv4-address": "10.0.0.2/24",
-                "sgi-ipv4-gateway": "10.0.0.1",
-            }
-        )
-        self.harness.update_config(
+            id="invalid_sgi_ipv4_gateway",
+        ),
+        pytest.param(
             {
+                "sgi-ipv4-address": IPV4_ADDRESS,
+                "sgi-ipv4-gateway": IPV4_GATEWAY,
                 "sgi-ipv6-address": "not ipv6",
-                "sgi-ipv6-gateway": "2001:0db8:85a3:0000:0000:8a2e:0370:7331",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+                "sgi-ipv6-gateway": IPV6_GATEWAY,
+            },
             "Invalid IPv6 address and netmask for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_sgi_ipv6_address_missing_netmask_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "sgi-ipv4-address": "10.0.0.2/24",
-                "sgi-ipv4-gateway": "10.0.0.1",
-            }
-        )
-        self.harness.update_config(
+            id="invalid_sgi_ipv6_address",
+        ),
+        pytest.param(
             {
+                "sgi-ipv4-address": IPV4_ADDRESS,
+                "sgi-ipv4-gateway": IPV4_GATEWAY,
                 "sgi-ipv6-address": "2001:0db8:85a3:0000:0000:8a2e:0370:7332",
-                "sgi-ipv6-gateway": "2001:0db8:85a3:0000:0000:8a2e:0370:7331",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+                "sgi-ipv6-gateway": IPV6_GATEWAY,
+            },
             "Invalid IPv6 address and netmask for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_sgi_ipv6_gateway_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
+            id="sgi_ipv6_address_missing_netmask",
+        ),
+        pytest.param(
             {
-                "sgi-ipv4-address": "10.0.0.2/24",
-                "sgi-ipv4-gateway": "10.0.0.1",
-            }
-        )
-        self.harness.update_config(
-            {
-                "sgi-ipv6-address": "2001:0db8:85a3:0000:0000:8a2e:0370:7334/64",
+                "sgi-ipv4-address": IPV4_ADDRESS,
+                "sgi-ipv4-gateway": IPV4_GATEWAY,
+                "sgi-ipv6-address": IPV6_ADDRESS,
                 "sgi-ipv6-gateway": "not a gateway",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            },
             "Invalid IPv6 gateway for interface sgi",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_only_ipv6_s1_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "s1-ipv6-address": "2001:0db8:85a3:0000:0000:8a2e:0370:7334/64",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            id="invalid_sgi_ipv6_gateway",
+        ),
+        pytest.param(
+            {"s1-ipv6-address": IPV6_ADDRESS},
             "Pure IPv6 configuration is not supported for interface s1",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_s1_ipv4_address_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "s1-ipv4-address": "invalidip",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            id="only_ipv6_s1",
+        ),
+        pytest.param(
+            {"s1-ipv4-address": "invalidip"},
             "Invalid IPv4 address and netmask for interface s1",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_s1_ipv6_address_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "s1-ipv4-address": "10.0.0.2/24",
-            }
-        )
-        self.harness.update_config(
-            {
-                "s1-ipv6-address": "not ipv6",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            id="invalid_s1_ipv4_address",
+        ),
+        pytest.param(
+            {"s1-ipv4-address": IPV4_ADDRESS, "s1-ipv6-address": "not ipv6"},
             "Invalid IPv6 address and netmask for interface s1",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_invalid_dns_config_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "dns": "notjson",
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
+            id="invalid_s1_ipv6_address",
+        ),
+        pytest.param({"dns": "notjson"}, "Invalid DNS configuration", id="invalid_dns"),
+        pytest.param(
+            {"dns": '{"dns": "8.8.8.8"}'}, "Invalid DNS configuration", id="dns_not_list"
+        ),
+        pytest.param(
+            {"dns": '["8.8.8.8", "dns1.example.com"]'},
             "Invalid DNS configuration",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_dns_config_not_list_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "dns": '{"dns": "8.8.8.8"}',
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
-            "Invalid DNS configuration",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_dns_config_contains_non_ip_when_install_then_status_is_blocked(
-        self,
-        patch_interfaces,
-        patch_subprocess_run,
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.harness.update_config(
-            {
-                "dns": '["8.8.8.8", "dns1.example.com"]',
-            }
-        )
-        with self.assertLogs() as captured:
-            self.charm._on_install(event=event)
-
-        self.assertEqual(
-            self.charm.unit.status,
-            BlockedStatus("Configuration is invalid. Check logs for details"),
-        )
-        self.assertEqual(
-            "Invalid DNS configuration",
-            captured.records[0].getMessage(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_valid_dhcp_config_when_update_config_then_status_is_active(
-        self, patch_interfaces, patch_subprocess_run
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        patch_subprocess_run.side_effect = [
-            Mock(returncode=1),
-            Mock(returncode=0),
-            Mock(returncode=0),
-            Mock(returncode=0),
-            Mock(returncode=0),
-        ]
-        self.harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
-        self.charm._on_start(event=event)
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(["systemctl", "is-enabled", "magma@magmad"], stdout=-1),
-                call(
-                    ["snap", "install", "magma-access-gateway", "--classic", "--edge"], stdout=-1
-                ),
-                call(
-                    [
-                        "magma-access-gateway.install",
-                        "--no-reboot",
-                        "--dns",
-                        "8.8.8.8",
-                        "208.67.222.222",
-                        "--sgi",
-                        "enp0s1",
-                        "--s1",
-                        "enp0s2",
-                    ],
-                    stdout=-1,
-                ),
-                call(["shutdown", "--reboot", "+1"], stdout=-1),
-                call(["systemctl", "is-active", "magma@magmad"], stdout=-1),
-            ]
-        )
-        self.assertEqual(
-            self.charm.unit.status,
-            ActiveStatus(),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_valid_static_config_when_install_then_status_is_maintenance(
-        self, patch_interfaces, patch_subprocess_run
-    ):
-        event = Mock()
-        patch_interfaces.return_value = ["enp0s1", "enp0s2"]
-        patch_subprocess_run.side_effect = [
-            Mock(returncode=1),
-            Mock(returncode=0),
-            Mock(returncode=0),
-            Mock(returncode=0),
-            Mock(returncode=0),
-        ]
-        self.harness.update_config(
-            {
-                "sgi": "enp0s1",
-                "s1": "enp0s2",
-                "sgi-ipv4-address": "10.0.0.2/24",
-                "sgi-ipv4-gateway": "10.0.0.1",
-                "sgi-ipv6-address": "2001:0db8:85a3:0000:0000:8a2e:0370:7334/64",
-                "sgi-ipv6-gateway": "2001:0db8:85a3:0000:0000:8a2e:0370:7331",
-                "s1-ipv4-address": "10.1.0.2/24",
-                "s1-ipv6-address": "2002:0db8:85a3:0000:0000:8a2e:0370:7334/64",
-            }
-        )
-        self.charm._on_install(event=event)
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(["systemctl", "is-enabled", "magma@magmad"], stdout=-1),
-                call(
-                    ["snap", "install", "magma-access-gateway", "--classic", "--edge"], stdout=-1
-                ),
-                call(
-                    [
-                        "magma-access-gateway.install",
-                        "--no-reboot",
-                        "--dns",
-                        "8.8.8.8",
-                        "208.67.222.222",
-                        "--sgi",
-                        "enp0s1",
-                        "--s1",
-                        "enp0s2",
-                        "--sgi-ipv4-address",
-                        "10.0.0.2/24",
-                        "--sgi-ipv4-gateway",
-                        "10.0.0.1",
-                        "--sgi-ipv6-address",
-                        "2001:0db8:85a3:0000:0000:8a2e:0370:7334/64",
-                        "--sgi-ipv6-gateway",
-                        "2001:0db8:85a3:0000:0000:8a2e:0370:7331",
-                        "--s1-ipv4-address",
-                        "10.1.0.2/24",
-                        "--s1-ipv6-address",
-                        "2002:0db8:85a3:0000:0000:8a2e:0370:7334/64",
-                    ],
-                    stdout=-1,
-                ),
-                call(["shutdown", "--reboot", "+1"], stdout=-1),
-                call(["systemctl", "is-enabled", "magma@magmad"], stdout=-1),
-            ]
-        )
-        self.assertEqual(
-            self.charm.unit.status,
-            MaintenanceStatus("Rebooting to apply changes"),
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_magma_service_not_running_when_start_then_status_is_unchanged(
-        self, patch_interfaces, patch_subprocess_run
-    ):
-        event = Mock()
-        expected_status = self.charm.unit.status
-        completed_process = Mock(returncode=1)
-        patch_subprocess_run.return_value = completed_process
-
-        self.charm._on_start(event=event)
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(
-                    ["systemctl", "is-active", "magma@magmad"],
-                    stdout=-1,
-                ),
-            ]
-        )
-        self.assertEqual(
-            self.charm.unit.status,
-            expected_status,
-        )
-
-    @patch("subprocess.run")
-    @patch("netifaces.interfaces")
-    def test_given_magma_service_running_when_start_then_status_is_active(
-        self, patch_interfaces, patch_subprocess_run
-    ):
-        event = Mock()
-        completed_process = Mock(returncode=0)
-        patch_subprocess_run.return_value = completed_process
-
-        self.charm._on_start(event=event)
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(
-                    ["systemctl", "is-active", "magma@magmad"],
-                    stdout=-1,
-                ),
-            ]
-        )
-        self.assertEqual(
-            self.charm.unit.status,
-            ActiveStatus(),
-        )
-
-    @patch("subprocess.check_output")
-    @patch("subprocess.run")
-    def test_given_magma_service_running_when_get_access_gateway_secrets_action_then_hardware_id_and_challenge_key_are_returned(  # noqa: E501
-        self, patch_subprocess_run, patched_check_output
-    ):
-        completed_process = Mock(returncode=0)
-        patch_subprocess_run.return_value = completed_process
-        test_hw_id = "1234-abc-5678"
-        test_challenge_key = "whatever"
-        action_event = Mock()
-        patched_check_output.return_value = f"""Hardware ID
-------------
-{test_hw_id}
-
-Challenge key
------------
-{test_challenge_key}
-""".encode(
-            "utf-8"
-        )
-
-        self.charm._on_get_access_gateway_secrets(action_event)
-
-        self.assertEqual(
-            action_event.set_results.call_args,
-            call({"hardware-id": test_hw_id, "challenge-key": test_challenge_key}),
-        )
-
-    @patch("subprocess.run")
-    def test_given_magma_service_not_running_when_get_access_gateway_secrets_action_then_action_fails(  # noqa: E501
-        self, patch_subprocess_run
-    ):
-        completed_process = Mock(returncode=1)
-        patch_subprocess_run.return_value = completed_process
-        action_event = Mock()
-
-        self.charm._on_get_access_gateway_secrets(action_event)
-
-        self.assertEqual(
-            action_event.fail.call_args,
-            call("Magma is not running! Please start Magma and try again."),
-        )
-
-    @patch("subprocess.check_output")
-    @patch("subprocess.run")
-    def test_given_magma_service_running_but_gateway_info_doesnt_return_anything_when_get_access_gateway_secrets_action_then_action_fails(  # noqa: E501
-        self, patch_subprocess_run, patched_check_output
-    ):
-        completed_process = Mock(returncode=0)
-        patch_subprocess_run.return_value = completed_process
-        action_event = Mock()
-        patched_check_output.return_value = "".encode("utf-8")
-
-        self.charm._on_get_access_gateway_secrets(action_event)
-
-        self.assertEqual(
-            action_event.fail.call_args,
-            call("Failed to get Magma Access Gateway secrets!"),
-        )
-
-    @patch("subprocess.check_output")
-    @patch("subprocess.run")
-    def test_given_magma_service_running_but_gateway_info_doesnt_return_values_for_secrets_when_get_access_gateway_secrets_action_then_action_fails(  # noqa: E501
-        self, patch_subprocess_run, patched_check_output
-    ):
-        completed_process = Mock(returncode=0)
-        patch_subprocess_run.return_value = completed_process
-        action_event = Mock()
-        patched_check_output.return_value = """Hardware ID
-------------
-
-Challenge key
------------
-""".encode(
-            "utf-8"
-        )
+            id="dns_contains_non_ip",
+        ),
+    ],
+)
+def test_given_invalid_config_when_install_then_status_is_blocked(
+    failing_commands, harness, caplog, config, expected_log
+):
+    event = Mock()
+    harness.update_config({"sgi": "enp0s1", "s1": "enp0s2", **config})
+    caplog.clear()
+    harness.charm._on_install(event=event)
+
+    assert harness.charm.unit.status == BlockedStatus(
+        "Configuration is invalid. Check logs for details"
+    )
+    assert caplog.records[0].getMessage() == expected_log
+
+
+def test_given_valid_dhcp_config_when_update_config_then_status_is_active(fp, harness):
+    event = Mock()
+    install_command = [
+        *MAGMA_INSTALL,
+        "--dns",
+        "8.8.8.8",
+        "208.67.222.222",
+        "--sgi",
+        "enp0s1",
+        "--s1",
+        "enp0s2",
+    ]
+    fp.register(SYSTEMCTL_IS_ENABLED, returncode=1)
+    fp.register(SNAP_INSTALL)
+    fp.register(install_command)
+    fp.register(SHUTDOWN)
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+    harness.update_config({"sgi": "enp0s1", "s1": "enp0s2"})
+    harness.charm._on_start(event=event)
+
+    assert list(fp.calls) == [
+        SYSTEMCTL_IS_ENABLED,
+        SNAP_INSTALL,
+        install_command,
+        SHUTDOWN,
+        SYSTEMCTL_IS_ACTIVE,
+    ]
+    assert harness.charm.unit.status == ActiveStatus()
+
+
+def test_given_valid_static_config_when_install_then_status_is_maintenance(fp, harness):
+    event = Mock()
+    install_command = [
+        *MAGMA_INSTALL,
+        "--dns",
+        "8.8.8.8",
+        "208.67.222.222",
+        "--sgi",
+        "enp0s1",
+        "--s1",
+        "enp0s2",
+        "--sgi-ipv4-address",
+        IPV4_ADDRESS,
+        "--sgi-ipv4-gateway",
+        IPV4_GATEWAY,
+        "--sgi-ipv6-address",
+        IPV6_ADDRESS,
+        "--sgi-ipv6-gateway",
+        IPV6_GATEWAY,
+        "--s1-ipv4-address",
+        "10.1.0.2/24",
+        "--s1-ipv6-address",
+        "2002:0db8:85a3:0000:0000:8a2e:0370:7334/64",
+    ]
+    fp.register(SYSTEMCTL_IS_ENABLED, returncode=1)
+    fp.register(SNAP_INSTALL)
+    fp.register(install_command)
+    fp.register(SHUTDOWN)
+    fp.register(SYSTEMCTL_IS_ENABLED, returncode=0)
+    harness.update_config(
+        {
+            "sgi": "enp0s1",
+            "s1": "enp0s2",
+            "sgi-ipv4-address": IPV4_ADDRESS,
+            "sgi-ipv4-gateway": IPV4_GATEWAY,
+            "sgi-ipv6-address": IPV6_ADDRESS,
+            "sgi-ipv6-gateway": IPV6_GATEWAY,
+            "s1-ipv4-address": "10.1.0.2/24",
+            "s1-ipv6-address": "2002:0db8:85a3:0000:0000:8a2e:0370:7334/64",
+        }
+    )
+    harness.charm._on_install(event=event)
+
+    assert list(fp.calls) == [
+        SYSTEMCTL_IS_ENABLED,
+        SNAP_INSTALL,
+        install_command,
+        SHUTDOWN,
+        SYSTEMCTL_IS_ENABLED,
+    ]
+    assert harness.charm.unit.status == MaintenanceStatus("Rebooting to apply changes")
+
+
+def test_given_magma_service_not_running_when_start_then_status_is_unchanged(fp, harness):
+    event = Mock()
+    expected_status = harness.charm.unit.status
+    fp.register(SYSTEMCTL_IS_ACTIVE, returncode=1)
+
+    harness.charm._on_start(event=event)
+
+    assert list(fp.calls) == [SYSTEMCTL_IS_ACTIVE]
+    assert harness.charm.unit.status == expected_status
+
+
+def test_given_magma_service_running_when_start_then_status_is_active(fp, harness):
+    event = Mock()
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+
+    harness.charm._on_start(event=event)
+
+    assert list(fp.calls) == [SYSTEMCTL_IS_ACTIVE]
+    assert harness.charm.unit.status == ActiveStatus()
+
+
+def test_given_magma_service_state_already_checked_when_start_then_systemctl_is_not_called_again(
+    fp, harness
+):
+    event = Mock()
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+
+    harness.charm._on_start(event=event)
+    harness.charm._on_start(event=event)
+
+    assert list(fp.calls) == [SYSTEMCTL_IS_ACTIVE]
+
+
+def test_given_magma_service_running_when_get_access_gateway_secrets_action_then_hardware_id_and_challenge_key_are_returned(  # noqa: E501
+    fp, harness, action_event
+):
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+    fp.register(SHOW_GATEWAY_INFO, stdout=GATEWAY_INFO)
+
+    harness.charm._on_get_access_gateway_secrets(action_event)
+
+    action_event.set_results.assert_called_once_with(
+        {"hardware-id": "1234-abc-5678", "challenge-key": "whatever"}
+    )
+
+
+def test_given_magma_service_not_running_when_get_access_gateway_secrets_action_then_action_fails(
+    fp, harness, action_event
+):
+    fp.register(SYSTEMCTL_IS_ACTIVE, returncode=1)
+
+    harness.charm._on_get_access_gateway_secrets(action_event)
+
+    action_event.fail.assert_called_once_with(
+        "Magma is not running! Please start Magma and try again."
+    )
+
+
+@pytest.mark.parametrize(
+    "gateway_info",
+    [
+        pytest.param(b"", id="empty_output"),
+        pytest.param(GATEWAY_INFO_WITHOUT_SECRETS, id="missing_values"),
+    ],
+)
+def test_given_magma_service_running_but_gateway_info_doesnt_return_secrets_when_get_access_gateway_secrets_action_then_action_fails(  # noqa: E501
+    fp, harness, action_event, gateway_info
+):
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+    fp.register(SHOW_GATEWAY_INFO, stdout=gateway_info)
+
+    harness.charm._on_get_access_gateway_secrets(action_event)
+
+    action_event.fail.assert_called_once_with("Failed to get Magma Access Gateway secrets!")
+
+
+@pytest.mark.parametrize(
+    "returncode,expected_output",
+    [
+        pytest.param(
+            1,
+            "Post-installation checks failed. For more information, please check journalctl logs.",  # noqa: E501
+            id="failed",
+        ),
+        pytest.param(
+            0, "Magma AGW post-installation checks finished successfully.", id="successful"
+        ),
+    ],
+)
+def test_given_post_install_checks_result_when_post_install_checks_action_then_message_is_set_in_action_results(  # noqa: E501
+    fp, harness, action_event, returncode, expected_output
+):
+    fp.register(POST_INSTALL_CHECKS, returncode=returncode)
+
+    harness.charm._on_post_install_checks_action(event=action_event)
+
+    action_event.set_results.assert_called_once_with(
+        {"post-install-checks-output": expected_output}
+    )
+
+
+def test_given_magma_service_enabled_when_install_then_nothing_done(fp, harness):
+    event = Mock()
+    fp.register(SYSTEMCTL_IS_ENABLED)
+
+    harness.charm._on_install(event=event)
+
+    assert list(fp.calls) == [SYSTEMCTL_IS_ENABLED]
+
+
+def test_given_certifier_pem_not_stored_when_certifier_pem_changed_then_remove_agw_certs_not_called(  # noqa: E501
+    failing_commands, harness, magma_paths
+):
+    relation_id = harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
+    harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
+    harness.update_relation_data(
+        relation_id,
+        "orc8r-nginx-operator",
+        ORCHESTRATOR_APP_DATA,
+    )
+    assert (magma_paths / "gateway.crt").exists()
+    assert (magma_paths / "gateway.key").exists()
+    assert (magma_paths / "gw_challenge.key").exists()
+
+
+def test_given_certifier_pem_stored_when_certifier_pem_changed_then_remove_agw_certs_called(
+    failing_commands, harness, magma_paths
+):
+    (magma_paths / "tmp" / "certs").mkdir()
+    (magma_paths / "tmp" / "certs" / "certifier.pem").write_text("old_certifier_pem_content")
+    relation_id = harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
+    harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
+    harness.update_relation_data(
+        relation_id,
+        "orc8r-nginx-operator",
+        ORCHESTRATOR_APP_DATA,
+    )
+    assert not (magma_paths / "gateway.crt").exists()
+    assert not (magma_paths / "gateway.key").exists()
+    assert not (magma_paths / "gw_challenge.key").exists()
+
+
+def test_when_orchestrator_available_event_then_configuration_is_installed(
+    fp, harness, magma_paths
+):
+    fp.register(SERVICE_STOP)
+    fp.register(SERVICE_START)
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+    relation_id = harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
+    harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
+    harness.update_relation_data(
+        relation_id,
+        "orc8r-nginx-operator",
+        ORCHESTRATOR_APP_DATA,
+    )
+
+    assert (
+        magma_paths / "tmp" / "certs" / "rootCA.pem"
+    ).read_text() == "root_ca_certificate_content"
+    assert (
+        magma_paths / "tmp" / "certs" / "certifier.pem"
+    ).read_text() == "certifier_pem_certificate_content"
+    assert (magma_paths / "configs" / "control_proxy.yml").read_text() == (
+        "cloud_address: orchestrator.com\n"
+        "cloud_port: 42\n"
+        "bootstrap_address: bootstrapper.com\n"
+        "bootstrap_port: 42\n"
+        "fluentd_address: fluentd.com\n"
+        "fluentd_port: 42\n"
+        "\n"
+        f"rootca_cert: {magma_paths / 'tmp' / 'certs' / 'rootCA.pem'}\n"
+    )
+
+    assert list(fp.calls) == [SERVICE_STOP, SERVICE_START, SYSTEMCTL_IS_ACTIVE]
+
+
+def test_given_magma_restarted_recently_when_orchestrator_available_event_then_restart_is_deferred(
+    fp, harness, magma_paths
+):
+    harness.charm._stored.last_restart = time.time()
+    relation_id = harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
+    harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
+    harness.update_relation_data(
+        relation_id,
+        "orc8r-nginx-operator",
+        ORCHESTRATOR_APP_DATA,
+    )
+
+    assert list(fp.calls) == []
+    assert harness.charm._stored.restart_pending
+
+
+@patch("charm.time")
+def test_given_restart_deferred_for_several_orchestrator_updates_when_events_are_reemitted_after_debounce_then_magma_is_restarted_once_with_latest_configuration(  # noqa: E501
+    patch_time, fp, harness, magma_paths
+):
+    patch_time.time.return_value = 1000.0
+    harness.charm._stored.last_restart = 1000.0
+    relation_id = harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
+    harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
+    for offset, orchestrator_address in ((0, "a.com"), (10, "b.com"), (20, "c.com")):
+        patch_time.time.return_value = 1000.0 + offset
+        harness.update_relation_data(
+            relation_id,
+            "orc8r-nginx-operator",
+            {**ORCHESTRATOR_APP_DATA, "orchestrator_address": orchestrator_address},
+        )
+    assert list(fp.calls) == []
+    fp.register(SERVICE_STOP)
+    fp.register(SERVICE_START)
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+    patch_time.time.return_value = 1000.0 + RESTART_DEBOUNCE_SECONDS
+
+    harness.framework.reemit()
+
+    assert list(fp.calls) == [SERVICE_STOP, SERVICE_START, SYSTEMCTL_IS_ACTIVE]
+    assert not harness.charm._stored.restart_pending
+    assert "cloud_address: c.com\n" in (magma_paths / "configs" / "control_proxy.yml").read_text()
+    assert harness.charm.unit.status == ActiveStatus()
+
+
+@patch("charm.time")
+def test_given_certifier_pem_changed_and_restart_deferred_when_event_is_reemitted_after_debounce_then_agw_certs_are_removed(  # noqa: E501
+    patch_time, fp, harness, magma_paths
+):
+    (magma_paths / "tmp" / "certs").mkdir()
+    (magma_paths / "tmp" / "certs" / "certifier.pem").write_text("old_certifier_pem_content")
+    patch_time.time.return_value = 1000.0
+    harness.charm._stored.last_restart = 1000.0
+    relation_id = harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
+    harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
+    harness.update_relation_data(relation_id, "orc8r-nginx-operator", ORCHESTRATOR_APP_DATA)
+    assert (magma_paths / "gateway.crt").exists()
+    assert (magma_paths / "gateway.key").exists()
+    assert (magma_paths / "gw_challenge.key").exists()
+    fp.register(SERVICE_STOP)
+    fp.register(SERVICE_START)
+    fp.register(SYSTEMCTL_IS_ACTIVE)
+    patch_time.time.return_value = 1000.0 + RESTART_DEBOUNCE_SECONDS
+
+    harness.framework.reemit()
+
+    assert list(fp.calls) == [SERVICE_STOP, SERVICE_START, SYSTEMCTL_IS_ACTIVE]
+    assert not (magma_paths / "gateway.crt").exists()
+    assert not (magma_paths / "gateway.key").exists()
+    assert not (magma_paths / "gw_challenge.key").exists()
 
-        self.charm._on_get_access_gateway_secrets(action_event)
 
-        self.assertEqual(
-            action_event.fail.call_args,
-            call("Failed to get Magma Access Gateway secrets!"),
-        )
+@patch("netifaces.ifaddresses")
+def test_given_eth1_interface_is_available_and_unit_is_leader_when_lte_core_relation_joined_then_then_core_information_is_set(  # noqa: E501
+    patch_ip_address, harness
+):
+    harness.set_leader(True)
+    patch_ip_address.return_value = {2: [{"addr": "0.0.0.0"}]}
+    relation_id = harness.add_relation("lte-core", "srs-enb-ue-operator")
+    harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
+    assert harness.get_relation_data(relation_id, harness.charm.app) == {
+        "mme_ipv4_address": "0.0.0.0"
+    }
 
-    @patch("subprocess.run")
-    def test_given_not_successful_post_install_checks_when_post_install_checks_action_then_error_message_is_set_in_action_results(  # noqa: E501
-        self, patch_subprocess_run
-    ):
-        patch_subprocess_run.return_value = Mock(returncode=1)
-        failed_msg = "Post-installation checks failed. For more information, please check journalctl logs."  # noqa: E501
-        action_event = Mock()
 
-        self.charm._on_post_install_checks_action(event=action_event)
+@patch("netifaces.ifaddresses")
+def test_given_eth1_interface_is_available_and_unit_is_leader_when_lte_core_relation_joined_then_charm_is_active(  # noqa: E501
+    patch_ip_address, harness
+):
+    harness.set_leader(True)
+    patch_ip_address.return_value = {2: [{"addr": "0.0.0.0"}]}
+    relation_id = harness.add_relation("lte-core", "srs-enb-ue-operator")
+    harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
+    assert harness.charm.unit.status == ActiveStatus()
 
-        self.assertEqual(
-            action_event.set_results.call_args,
-            call({"post-install-checks-output": failed_msg}),
-        )
 
-    @patch("subprocess.run")
-    def test_given_successful_post_install_checks_when_post_install_checks_action_then_success_message_is_set_in_action_results(  # noqa: E501
-        self, patch_subprocess_run
-    ):
-        patch_subprocess_run.return_value = Mock(returncode=0)
-        successful_msg = "Magma AGW post-installation checks finished successfully."
-        action_event = Mock()
+def test_given_eth1_interface_is_available_and_unit_is_not_leader_when_lte_core_relation_joined_then_core_information_is_not_set(  # noqa: E501
+    harness,
+):
+    harness.set_leader(False)
+    relation_id = harness.add_relation("lte-core", "srs-enb-ue-operator")
+    harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
+    assert harness.get_relation_data(relation_id, harness.charm.app) == {}
 
-        self.charm._on_post_install_checks_action(event=action_event)
 
-        self.assertEqual(
-            action_event.set_results.call_args,
-            call({"post-install-checks-output": successful_msg}),
-        )
+def test_given_eth1_interface_is_not_available_when_lte_core_relation_joined_then_core_information_is_not_set(  # noqa: E501
+    harness,
+):
+    harness.set_leader(True)
+    relation_id = harness.add_relation("lte-core", "srs-enb-ue-operator")
+    harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
+    assert harness.get_relation_data(relation_id, harness.charm.app) == {}
 
-    @patch("subprocess.run")
-    def test_given_magma_service_enabled_when_install_then_nothing_done(
-        self, patch_subprocess_run
-    ):
-        event = Mock()
-        patch_subprocess_run.side_effect = [Mock(returncode=0)]
-
-        self.charm._on_install(event=event)
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(
-                    ["systemctl", "is-enabled", "magma@magmad"],
-                    stdout=-1,
-                ),
-            ]
-        )
 
-    @patch("subprocess.run")
-    @patch("charm.Path")
-    def test_given_certifier_pem_not_stored_when_certifier_pem_changed_then_remove_agw_certs_not_called(  # noqa: E501
-        self, patch_path, _
-    ):
-        patch_path.return_value.exists.return_value = False
-        relation_id = self.harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
-        self.harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "orc8r-nginx-operator",
-            {
-                "root_ca_certificate": "root_ca_certificate_content",
-                "certifier_pem_certificate": "certifier_pem_certificate_content",
-                "orchestrator_address": "orchestrator.com",
-                "orchestrator_port": "42",
-                "bootstrapper_address": "bootstrapper.com",
-                "bootstrapper_port": "42",
-                "fluentd_address": "fluentd.com",
-                "fluentd_port": "42",
-            },
-        )
-        self.assertNotIn(call().unlink(), patch_path.mock_calls)
+def test_given_eth1_interface_is_not_available_when_lte_core_relation_joined_then_charm_is_in_waiting_status(  # noqa: E501
+    harness,
+):
+    harness.set_leader(True)
+    relation_id = harness.add_relation("lte-core", "srs-enb-ue-operator")
+    harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
+    assert harness.charm.unit.status == WaitingStatus("Waiting for the MME interface to be ready")
 
-    @patch("subprocess.run")
-    @patch("charm.Path")
-    def test_given_certifier_pem_stored_when_certifier_pem_changed_then_remove_agw_certs_called(
-        self, patch_path, _
-    ):
-        relation_id = self.harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
-        self.harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "orc8r-nginx-operator",
-            {
-                "root_ca_certificate": "root_ca_certificate_content",
-                "certifier_pem_certificate": "certifier_pem_certificate_content",
-                "orchestrator_address": "orchestrator.com",
-                "orchestrator_port": "42",
-                "bootstrapper_address": "bootstrapper.com",
-                "bootstrapper_port": "42",
-                "fluentd_address": "fluentd.com",
-                "fluentd_port": "42",
-            },
-        )
-        self.assertIn(call().unlink(), patch_path.mock_calls)
 
-    @patch("charm.Path")
-    @patch("subprocess.run")
-    def test_when_orchestrator_available_event_then_configuration_is_installed(
-        self, patch_subprocess_run, patch_path
-    ):
-        relation_id = self.harness.add_relation("magma-orchestrator", "orc8r-nginx-operator")
-        self.harness.add_relation_unit(relation_id, "orc8r-nginx-operator/0")
-        self.harness.update_relation_data(
-            relation_id,
-            "orc8r-nginx-operator",
-            {
-                "root_ca_certificate": "root_ca_certificate_content",
-                "certifier_pem_certificate": "certifier_pem_certificate_content",
-                "orchestrator_address": "orchestrator.com",
-                "orchestrator_port": "42",
-                "bootstrapper_address": "bootstrapper.com",
-                "bootstrapper_port": "42",
-                "fluentd_address": "fluentd.com",
-                "fluentd_port": "42",
-            },
-        )
+def test_given_directory_does_not_exist_when_install_file_then_directory_is_created():
+    with tempfile.TemporaryDirectory() as directory:
+        file = pathlib.Path(directory) / "does_not_exist" / "file.txt"
 
-        mock_calls = patch_path.mock_calls
-        expected_calls = [
-            call("/var/opt/magma/tmp/certs/rootCA.pem"),
-            call().write_text("root_ca_certificate_content"),
-            call("/var/opt/magma/tmp/certs/certifier.pem"),
-            call().write_text("root_ca_certificate_content"),
-            call("/var/opt/magma/configs/control_proxy.yml"),
-            call().write_text(
-                "cloud_address: orchestrator.com\n"
-                "cloud_port: 42\n"
-                "bootstrap_address: bootstrapper.com\n"
-                "bootstrap_port: 42\n"
-                "fluentd_address: fluentd.com\n"
-                "fluentd_port: 42\n"
-                "\n"
-                "rootca_cert: /var/opt/magma/tmp/certs/rootCA.pem\n"
-            ),
-        ]
-        self.assertTrue(all(call in mock_calls for call in expected_calls))
-
-        patch_subprocess_run.assert_has_calls(
-            [
-                call(
-                    ["service", "magma@*", "stop"],
-                    stdout=-1,
-                ),
-                call(
-                    ["service", "magma@magmad", "start"],
-                    stdout=-1,
-                ),
-            ]
-        )
+        install_file(file, "content")
 
-    @patch("netifaces.ifaddresses")
-    def test_given_eth1_interface_is_available_and_unit_is_leader_when_lte_core_relation_joined_then_then_core_information_is_set(  # noqa: E501
-        self,
-        patch_ip_address,
-    ):
-        self.harness.set_leader(True)
-        patch_ip_address.return_value = {2: [{"addr": "0.0.0.0"}]}
-        relation_id = self.harness.add_relation("lte-core", "srs-enb-ue-operator")
-        self.harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
-        self.assertEqual(
-            self.harness.get_relation_data(relation_id, self.charm.app),
-            {"mme_ipv4_address": "0.0.0.0"},
-        )
+        assert file.parent.exists()
 
-    @patch("netifaces.ifaddresses")
-    def test_given_eth1_interface_is_available_and_unit_is_leader_when_lte_core_relation_joined_then_charm_is_active(  # noqa: E501
-        self,
-        patch_ip_address,
-    ):
-        self.harness.set_leader(True)
-        patch_ip_address.return_value = {2: [{"addr": "0.0.0.0"}]}
-        relation_id = self.harness.add_relation("lte-core", "srs-enb-ue-operator")
-        self.harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
-        self.assertEqual(
-            self.charm.unit.status,
-            ActiveStatus(),
-        )
 
-    def test_given_eth1_interface_is_available_and_unit_is_not_leader_when_lte_core_relation_joined_then_core_information_is_not_set(  # noqa: E501
-        self,
-    ):
-        self.harness.set_leader(False)
-        relation_id = self.harness.add_relation("lte-core", "srs-enb-ue-operator")
-        self.harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
-        self.assertEqual(
-            self.harness.get_relation_data(relation_id, self.charm.app),
-            {},
-        )
+def test_given_file_exists_and_already_has_content_when_install_file_then_return_false():
+    with tempfile.TemporaryDirectory() as directory:
+        file = pathlib.Path(directory) / "exists" / "file.txt"
+        file.parent.mkdir()
+        file.write_text("content")
+
+        assert not install_file(file, "content")
+
 
-    def test_given_eth1_interface_is_not_available_when_lte_core_relation_joined_then_core_information_is_not_set(  # noqa: E501
-        self,
-    ):
-        self.harness.set_leader(True)
-        relation_id = self.harness.add_relation("lte-core", "srs-enb-ue-operator")
-        self.harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
-        self.assertEqual(
-            self.harness.get_relation_data(relation_id, self.charm.app),
-            {},
-        )
+def test_given_file_exists_with_different_content_of_same_size_when_install_file_then_return_true_and_content_is_written():  # noqa: E501
+    with tempfile.TemporaryDirectory() as directory:
+        file = pathlib.Path(directory) / "exists" / "file.txt"
+        file.parent.mkdir()
+        file.write_text("CONTENT")
+
+        assert install_file(file, "content")
+        assert file.read_text() == "content"
 
-    def test_given_eth1_interface_is_not_available_when_lte_core_relation_joined_then_charm_is_in_waiting_status(  # noqa: E501
-        self,
-    ):
-        self.harness.set_leader(True)
-        relation_id = self.harness.add_relation("lte-core", "srs-enb-ue-operator")
-        self.harness.add_relation_unit(relation_id, "srs-enb-ue-operator/0")
-        self.assertEqual(
-            self.charm.unit.status,
-            WaitingStatus("Waiting for the MME interface to be ready"),
-        )
 
-    def test_given_directory_does_not_exist_when_install_file_then_directory_is_created(self):
-        with tempfile.TemporaryDirectory() as directory:
-            file = pathlib.Path(directory) / "does_not_exist" / "file.txt"
+def test_given_file_exists_without_content_when_install_file_then_return_true_and_content_is_written():  # noqa: E501
+    with tempfile.TemporaryDirectory() as directory:
+        file = pathlib.Path(directory) / "exists" / "file.txt"
+        file.parent.mkdir()
+        file.write_text("")
 
-            install_file(file, "content")
+        assert install_file(file, "content")
+        assert file.read_text() == "content"
 
-            self.assertTrue(file.parent.exists())
 
-    def test_given_file_exists_and_already_has_content_when_install_file_then_return_false(self):
-        with tempfile.TemporaryDirectory() as directory:
-            file = pathlib.Path(directory) / "exists" / "file.txt"
-            file.parent.mkdir()
-            file.write_text("content")
+def test_given_file_does_not_exist_when_install_file_then_return_true_and_content_is_written():
+    with tempfile.TemporaryDirectory() as directory:
+        file = pathlib.Path(directory) / "exists" / "file.txt"
 
-            self.assertFalse(install_file(file, "content"))
+        assert install_file(file, "content")
+        assert file.read_text() == "content"
 
-    def test_given_file_exists_without_content_when_install_file_then_return_true_and_content_is_written(  # noqa: E501
-        self,
-    ):
-        with tempfile.TemporaryDirectory() as directory:
-            file = pathlib.Path(directory) / "exists" / "file.txt"
-            file.parent.mkdir()
-            file.write_text("")
 
-            self.assertTrue(install_file(file, "content"))
-            self.assertEqual(file.read_text(), "content")
+def test_given_address_of_matching_family_when_is_valid_ip_address_then_return_true():
+    assert is_valid_ip_address(IPV4_GATEWAY, socket.AF_INET)
+    assert is_valid_ip_address(IPV6_GATEWAY, socket.AF_INET6)
 
-    def test_given_file_does_not_exist_when_install_file_then_return_true_and_content_is_written(  # noqa: E501
-        self,
-    ):
-        with tempfile.TemporaryDirectory() as directory:
-            file = pathlib.Path(directory) / "exists" / "file.txt"
 
-            self.assertTrue(install_file(file, "content"))
-            self.assertEqual(file.read_text(), "content")
+def test_given_invalid_address_when_is_valid_ip_address_then_return_false():
+    assert not is_valid_ip_address("2001:db8::1", socket.AF_INET)
+    assert not is_valid_ip_address("10.0.0.1/24", socket.AF_INET)
+    assert not is_valid_ip_address("dns1.example.com", socket.AF_INET6)
+    assert not is_valid_ip_address(8, socket.AF_INET)  # type: ignore[arg-type]